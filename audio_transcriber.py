@@ -1,9 +1,28 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
+import io
+import json
+import multiprocessing
 import os
+import queue
+import random
+import threading
 import time
 import tempfile
+import wave
+import zlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+)
+from contextlib import ExitStack
+from dataclasses import dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
 import sounddevice as sd
 import numpy as np
 import soundfile as sf
@@ -12,53 +31,321 @@ from reportlab.pdfgen import canvas
 from reportlab.pdfbase.pdfmetrics import stringWidth
 from datetime import timedelta
 
+try:
+    import blake3
+except ImportError:  # optional: multi-threaded SIMD hashing for the cache key
+    blake3 = None
+
 # AssemblyAI endpoints
 AAI_UPLOAD_URL     = "https://api.assemblyai.com/v2/upload"
 AAI_TRANSCRIBE_URL = "https://api.assemblyai.com/v2/transcript"
 
-def read_audio_bytes(path):
-    """Read an audio file and return raw bytes."""
+UPLOAD_CHUNK_SIZE  = 1 << 22
+UPLOAD_READ_AHEAD  = 4
+
+# Uncompressed containers worth gzipping; FLAC/MP3/etc. gain nothing
+GZIP_SUFFIXES      = (".wav", ".aif", ".aiff")
+
+# Files at least this large start uploading while the cache key is hashed
+SPECULATIVE_UPLOAD_MIN = 64 << 20
+
+# Seconds of mono audio buffered between the capture callback and disk
+RING_SECONDS       = 30
+
+# Completed transcripts, keyed by a hash of the audio content
+CACHE_DIR = Path(os.getenv("AAI_CACHE", "~/.py-transcriber/cache")).expanduser()
+
+class UploadCancelled(Exception):
+    """Raised from an upload body to abort the request mid-stream."""
+
+def read_audio_chunks(path, chunk_size=UPLOAD_CHUNK_SIZE,
+                      read_ahead=UPLOAD_READ_AHEAD, cancel=None):
+    """Yield an audio file in fixed-size chunks for streaming upload.
+
+    A background thread reads up to read_ahead chunks ahead, so disk
+    reads overlap with the socket send on the consuming thread. Setting
+    the optional cancel event raises UploadCancelled, so the connection
+    is dropped rather than the body ending cleanly.
+    """
+    chunks = queue.Queue(maxsize=read_ahead)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def reader():
+        try:
+            with open(path, "rb") as f:
+                while not stop.is_set() and (chunk := f.read(chunk_size)):
+                    put(chunk)
+        except OSError as e:
+            put(e)
+        put(None)
+
+    threading.Thread(target=reader, daemon=True).start()
+    try:
+        while (chunk := chunks.get()) is not None:
+            if cancel is not None and cancel.is_set():
+                raise UploadCancelled(path)
+            if isinstance(chunk, OSError):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+
+def gzip_chunks(chunks, level=1):
+    """Gzip-compress a stream of byte chunks (level 1 favours speed)."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if out := z.compress(chunk):
+            yield out
+    yield z.flush()
+
+def hash_file(path, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Return a hex digest of a file, read in chunks.
+
+    Uses BLAKE3 across all cores when the blake3 package is installed,
+    otherwise hashlib's BLAKE2b.
+    """
+    if blake3 is not None:
+        h = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    else:
+        h = hashlib.blake2b()
     with open(path, "rb") as f:
-        return f.read()
-
-def upload_to_assemblyai(path):
-    """Upload audio to AssemblyAI and return the upload URL."""
-    token = os.getenv("AAI_TOKEN")
-    if not token:
-        raise RuntimeError('Please set AAI_TOKEN: export AAI_TOKEN="your_key_here"')
-    headers = {"authorization": token}
-    data = read_audio_bytes(path)
-    resp = requests.post(AAI_UPLOAD_URL, headers=headers, data=data)
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_cached(key):
+    """Return the cached AssemblyAI JSON for key, or None on a miss."""
+    try:
+        with open(CACHE_DIR / f"{key}.json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def store_cached(key, result):
+    """Atomically write AssemblyAI JSON to the cache under key."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp, CACHE_DIR / f"{key}.json")
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+_session = None
+_session_lock = threading.Lock()
+_pool_maxsize = 16
+
+def _https_adapter():
+    """Build the retrying, pooled adapter mounted on the shared session."""
+    retry = Retry(total=5, backoff_factor=0.3,
+                  status_forcelist=[429, 500, 502, 503, 504])
+    return HTTPAdapter(pool_connections=8, pool_maxsize=_pool_maxsize,
+                       max_retries=retry)
+
+def set_pool_size(n):
+    """Grow the shared session's connection pool to hold n connections."""
+    global _pool_maxsize
+    with _session_lock:
+        if n > _pool_maxsize:
+            _pool_maxsize = n
+            if _session is not None:
+                _session.mount("https://", _https_adapter())
+
+def get_session():
+    """Return a shared, authorized requests.Session with keep-alive and retries.
+
+    $AAI_TOKEN is read once, when the session is first built; a missing
+    token is not remembered, so setting it later and retrying works.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            token = os.getenv("AAI_TOKEN")
+            if not token:
+                raise RuntimeError('Please set AAI_TOKEN: export AAI_TOKEN="your_key_here"')
+            session = requests.Session()
+            session.headers.update({"authorization": token})
+            session.mount("https://", _https_adapter())
+            _session = session
+        return _session
+
+_gzip_supported = None
+_gzip_probe_lock = threading.Lock()
+
+def gzip_upload_supported():
+    """Probe once whether the upload endpoint decodes Content-Encoding: gzip.
+
+    Uploads a tiny gzipped WAV and reads it back; gzip counts as supported
+    only if what was stored is the original, decompressed WAV.
+    """
+    global _gzip_supported
+    with _gzip_probe_lock:
+        if _gzip_supported is None:
+            buf = io.BytesIO()
+            with wave.open(buf, "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(8000)
+                w.writeframes(b"\0\0" * 800)
+            raw = buf.getvalue()
+            session = get_session()
+            try:
+                resp = session.post(AAI_UPLOAD_URL,
+                                    headers={"content-encoding": "gzip"},
+                                    data=b"".join(gzip_chunks([raw])))
+                resp.raise_for_status()
+                stored = session.get(resp.json()["upload_url"],
+                                     headers={"accept-encoding": "identity"})
+                stored.raise_for_status()
+                _gzip_supported = stored.content == raw
+            except (requests.RequestException, KeyError, ValueError):
+                _gzip_supported = False
+            if not _gzip_supported:
+                print("Upload endpoint does not accept gzip; sending raw audio.")
+        return _gzip_supported
+
+def upload_to_assemblyai(path, cancel=None, compress=False):
+    """Upload audio to AssemblyAI and return the upload URL.
+
+    With compress, uncompressed audio is sent with Content-Encoding: gzip
+    once gzip_upload_supported() has confirmed the endpoint decodes it;
+    if the upload is still rejected as 415, the raw file is sent instead.
+    """
+    session = get_session()
+    if (compress and path.lower().endswith(GZIP_SUFFIXES)
+            and gzip_upload_supported()):
+        resp = session.post(
+            AAI_UPLOAD_URL, headers={"content-encoding": "gzip"},
+            data=gzip_chunks(read_audio_chunks(path, cancel=cancel))
+        )
+        if resp.status_code != 415:
+            resp.raise_for_status()
+            return resp.json()["upload_url"]
+    resp = session.post(AAI_UPLOAD_URL,
+                        data=read_audio_chunks(path, cancel=cancel))
     resp.raise_for_status()
     return resp.json()["upload_url"]
 
-def request_transcription(audio_url):
+class BackgroundUpload:
+    """upload_to_assemblyai running on a daemon thread.
+
+    A daemon thread (unlike an executor worker) never delays interpreter
+    exit if the upload is abandoned.
+    """
+
+    def __init__(self, path, cancel, compress=False):
+        self._url = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run,
+                                        args=(path, cancel, compress),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, path, cancel, compress):
+        try:
+            self._url = upload_to_assemblyai(path, cancel, compress)
+        except BaseException as e:
+            self._error = e
+
+    def result(self):
+        """Wait for the upload; return its URL or re-raise its error."""
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._url
+
+def request_transcription(audio_url, webhook_url=None):
     """Request a diarized transcription and return the transcript ID."""
-    token = os.getenv("AAI_TOKEN")
-    headers = {"authorization": token, "content-type": "application/json"}
     payload = {
         "audio_url":      audio_url,
         "speaker_labels": True,
         "format_text":    True
     }
-    resp = requests.post(AAI_TRANSCRIBE_URL, headers=headers, json=payload)
+    if webhook_url:
+        payload["webhook_url"] = webhook_url
+    resp = get_session().post(AAI_TRANSCRIBE_URL, json=payload)
     resp.raise_for_status()
     return resp.json()["id"]
 
-def poll_transcription(transcript_id, interval=5):
-    """Poll the transcription endpoint until completion or error."""
-    token = os.getenv("AAI_TOKEN")
-    headers = {"authorization": token}
+def poll_transcription(transcript_id, interval=1.0, max_interval=30.0,
+                       prefix=""):
+    """Poll the transcription endpoint until completion or error.
+
+    The delay grows by 1.5x per attempt (with jitter) up to max_interval,
+    so short jobs return quickly and long ones don't hammer the API.
+    While queued/processing the response carries no text or words, so
+    the full transcript body is only downloaded by the final GET.
+    """
+    session = get_session()
     url = f"{AAI_TRANSCRIBE_URL}/{transcript_id}"
+    delay = interval
     while True:
-        resp = requests.get(url, headers=headers)
+        resp = session.get(url)
         resp.raise_for_status()
         j = resp.json()
         status = j.get("status")
         if status in ("completed", "error"):
             return j
-        print(f"... waiting (status: {status})")
-        time.sleep(interval)
+        print(f"{prefix}... waiting (status: {status})")
+        time.sleep(delay * random.uniform(0.8, 1.2))
+        delay = min(delay * 1.5, max_interval)
+
+class WebhookListener:
+    """Tiny HTTP server that receives AssemblyAI completion webhooks.
+
+    AssemblyAI POSTs {"transcript_id": ..., "status": ...} to the
+    webhook_url given in the transcript request. `public_url` must
+    forward to `port` on this machine (e.g. via ngrok); the server only
+    listens on `host`, loopback by default.
+    """
+
+    def __init__(self, public_url, port, host="127.0.0.1"):
+        self.public_url = public_url
+        self._events = {}
+        self._lock = threading.Lock()
+        listener = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = {}
+                tid = body.get("transcript_id")
+                if tid:
+                    listener._event(tid).set()
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _event(self, transcript_id):
+        with self._lock:
+            return self._events.setdefault(transcript_id, threading.Event())
+
+    def wait(self, transcript_id, timeout=None):
+        """Block until the webhook for transcript_id arrives or timeout."""
+        return self._event(transcript_id).wait(timeout)
+
+    def close(self):
+        """Stop the server and release its port."""
+        self._server.shutdown()
+        self._server.server_close()
 
 def format_segments(assembly_json):
     """Convert AssemblyAI JSON into speaker-tagged segments."""
@@ -71,146 +358,443 @@ def format_segments(assembly_json):
             "end":     duration,
             "text":    assembly_json.get("text", "")
         }]
+    # Words without a start time can't be placed in any segment
+    words = [w for w in assembly_json.get("words", []) if "start" in w]
+    # AssemblyAI already returns segments in start order
+    spans = labels.get("segments", [])
+    assert all(spans[i]["start"] <= spans[i + 1]["start"]
+               for i in range(len(spans) - 1)), "segments out of order"
+    # Words are time-ordered, so each segment's words are the contiguous
+    # slice [lo, hi) found by bisecting the word start times.
+    starts = np.fromiter((w["start"] for w in words),
+                         dtype=np.float64, count=len(words))
+    seg_starts = np.fromiter((s["start"] for s in spans),
+                             dtype=np.float64, count=len(spans))
+    seg_ends = np.fromiter((s["end"] for s in spans),
+                           dtype=np.float64, count=len(spans))
+    lo = np.searchsorted(starts, seg_starts, side="left").tolist()
+    hi = np.searchsorted(starts, seg_ends, side="left").tolist()
+    texts = [w["text"] for w in words]
     segments = []
-    words = assembly_json.get("words", [])
-    for seg in labels.get("segments", []):
-        spk   = seg.get("speaker_label")
-        start = seg.get("start", 0) / 1000.0
-        end   = seg.get("end",   0) / 1000.0
-        text  = " ".join(
-            w["text"] for w in words
-            if seg["start"] <= w.get("start", -1) < seg["end"]
-        )
+    for seg, i, j in zip(spans, lo, hi):
         segments.append({
-            "speaker": spk,
-            "start":   start,
-            "end":     end,
-            "text":    text
+            "speaker": seg.get("speaker_label"),
+            "start":   seg.get("start", 0) / 1000.0,
+            "end":     seg.get("end",   0) / 1000.0,
+            "text":    " ".join(texts[i:j])
         })
-    return sorted(segments, key=lambda x: x["start"])
+    return segments
 
 def auto_device(s):
     """Convert digit strings to int, else return the string."""
     return int(s) if s.isdigit() else s
 
+def positive_int(s):
+    """argparse type: an integer >= 1."""
+    try:
+        n = int(s)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {s!r}")
+    return n
+
+class RingBuffer:
+    """Preallocated single-producer/single-consumer float32 sample ring."""
+
+    def __init__(self, size):
+        self._buf  = np.zeros(size, dtype=np.float32)
+        self._size = size
+        self._head = 0   # total samples written
+        self._tail = 0   # total samples read
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def write(self, samples):
+        """Copy samples in; anything that doesn't fit is dropped and counted."""
+        with self._cond:
+            free = self._size - (self._head - self._tail)
+            if len(samples) > free:
+                self.dropped += len(samples) - free
+                samples = samples[:free]
+            n = len(samples)
+            i = self._head % self._size
+            first = min(n, self._size - i)
+            self._buf[i:i + first] = samples[:first]
+            self._buf[:n - first] = samples[first:]
+            self._head += n
+            self._cond.notify()
+
+    def read(self, timeout=None):
+        """Return all buffered samples, waiting up to timeout for some."""
+        with self._cond:
+            if self._head == self._tail:
+                self._cond.wait(timeout)
+            n = self._head - self._tail
+            i = self._tail % self._size
+            first = min(n, self._size - i)
+            out = np.concatenate((self._buf[i:i + first], self._buf[:n - first]))
+            self._tail += n
+            return out
+
+def record_to_file(path, samplerate, channels, device):
+    """Record mono 16-bit FLAC from device to path until Enter is pressed.
+
+    The audio callback only downmixes into a fixed RingBuffer; a writer
+    thread drains it to disk, keeping encoding and file I/O off the
+    real-time thread and memory bounded regardless of duration.
+    """
+    ring = RingBuffer(RING_SECONDS * samplerate)
+    done = threading.Event()
+    errors = []
+
+    def callback(indata, frames, t, status):
+        if channels > 1:
+            mono = indata.mean(axis=1, dtype=np.float32)
+        else:
+            mono = indata[:, 0].copy()
+        # Float→PCM16 conversion wraps out-of-range samples
+        np.clip(mono, -1.0, 1.0, out=mono)
+        ring.write(mono)
+
+    def writer(wav):
+        try:
+            while True:
+                finished = done.is_set()
+                block = ring.read(timeout=0.1)
+                if len(block):
+                    wav.write(block)
+                elif finished:
+                    return
+        except Exception as e:
+            errors.append(e)
+
+    # 16-bit FLAC is lossless for speech and far smaller to upload.
+    with sf.SoundFile(path, mode="w", samplerate=samplerate, channels=1,
+                      format="FLAC", subtype="PCM_16") as wav:
+        drain = threading.Thread(target=writer, args=(wav,))
+        drain.start()
+        try:
+            with sd.InputStream(samplerate=samplerate,
+                                channels=channels,
+                                device=device,
+                                dtype="float32",
+                                callback=callback):
+                input()
+        finally:
+            done.set()
+            drain.join()
+        if errors:
+            raise errors[0]
+    if ring.dropped:
+        print(f"⚠️  Dropped {ring.dropped} samples (disk too slow)")
+
+# (font, size) -> {char: width}; filled lazily by wrap_text
+_char_widths = {}
+
 def wrap_text(text, font, size, max_width):
-    """Wrap a single string to fit within max_width."""
-    words = text.split()
+    """Wrap a single string to fit within max_width.
+
+    Widths are summed from per-character metrics cached across calls,
+    so reportlab's stringWidth runs once per distinct character.
+    """
+    cw = _char_widths.setdefault((font, size), {})
+    def width(s):
+        total = 0.0
+        for ch in s:
+            w = cw.get(ch)
+            if w is None:
+                w = cw[ch] = stringWidth(ch, font, size)
+            total += w
+        return total
+    space_w = width(" ")
     lines = []
     current = ""
-    for w in words:
-        test = w if not current else f"{current} {w}"
-        if stringWidth(test, font, size) <= max_width:
-            current = test
+    current_w = 0.0
+    for w in text.split():
+        word_w = width(w)
+        test_w = word_w if not current else current_w + space_w + word_w
+        if test_w <= max_width:
+            current = w if not current else f"{current} {w}"
+            current_w = test_w
         else:
             if current:
                 lines.append(current)
             current = w
+            current_w = word_w
     if current:
         lines.append(current)
     return lines
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="AssemblyAI-powered speaker-diarizing transcriber"
-    )
-    parser.add_argument("-o", "--output",
-        help="Output file (.pdf or .txt)", required=False
-    )
-    parser.add_argument("--list-devices", action="store_true",
-        help="List all audio I/O devices and exit"
-    )
-    parser.add_argument("--device", type=auto_device, default=None,
-        help="Input device (index or name substring)"
-    )
-    args = parser.parse_args()
-
-    if args.list_devices:
-        print(sd.query_devices())
-        return
+def transcribe(audio_path, prefix="", webhook=None, webhook_timeout=3600,
+               use_cache=True, gzip_upload=False):
+    """Upload, request and poll a single file; return AssemblyAI JSON.
 
-    choice = input("Select input [(1) file, (2) microphone/interface]: ").strip()
-    if choice == "1":
-        audio_path = input("Path to audio file: ").strip()
-    elif choice == "2":
-        info = sd.query_devices(args.device, kind="input")
-        samplerate = int(info["default_samplerate"])
-        channels   = info["max_input_channels"]
-        name       = info["name"]
-        print(f"Recording from {name!r} (index={args.device})")
-        print(f"  samplerate={samplerate} Hz, channels={channels}")
-        print("  Press Enter to stop.")
-        rec_chunks = []
-        def callback(indata, frames, t, status):
-            rec_chunks.append(indata.copy())
-        with sd.InputStream(samplerate=samplerate,
-                            channels=channels,
-                            device=args.device,
-                            callback=callback):
-            input()
-        audio_arr = np.concatenate(rec_chunks, axis=0)
-        if channels > 1:
-            audio_arr = audio_arr.mean(axis=1)
-        tmp = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-        sf.write(tmp.name, audio_arr, samplerate)
-        audio_path = tmp.name
+    With a WebhookListener, wait for the completion callback and fetch
+    the result once; polling resumes if the callback never arrives.
+    With use_cache, identical audio is served from CACHE_DIR. Files of
+    SPECULATIVE_UPLOAD_MIN or more start uploading while they are hashed,
+    and a cache hit aborts that upload; smaller files hash first.
+    """
+    cancel = threading.Event()
+    upload = None
+    key = None
+    if use_cache:
+        if os.path.getsize(audio_path) >= SPECULATIVE_UPLOAD_MIN:
+            print(f"{prefix}Uploading audio…")
+            upload = BackgroundUpload(audio_path, cancel, gzip_upload)
+        try:
+            key = hash_file(audio_path)
+            cached = load_cached(key)
+        except BaseException:
+            # Don't leave an orphaned upload streaming with nobody waiting
+            cancel.set()
+            raise
+        if cached is not None:
+            cancel.set()
+            print(f"{prefix}Using cached transcript.")
+            return cached
+    if upload is None:
+        print(f"{prefix}Uploading audio…")
+        url = upload_to_assemblyai(audio_path, compress=gzip_upload)
     else:
-        print("Invalid choice.")
-        return
+        url = upload.result()
+    print(f"{prefix}Requesting transcription…")
+    tid = request_transcription(url, webhook.public_url if webhook else None)
+    print(f"{prefix}Waiting for completion…")
+    if webhook and not webhook.wait(tid, webhook_timeout):
+        print(f"{prefix}No webhook received; falling back to polling.")
+    result = poll_transcription(tid, prefix=prefix)
+    if key and result.get("status") == "completed":
+        try:
+            store_cached(key, result)
+        except OSError as e:
+            print(f"{prefix}⚠️  Could not write transcript cache: {e}")
+    return result
 
-    print("Uploading audio…")
-    url = upload_to_assemblyai(audio_path)
-    print("Requesting transcription…")
-    tid = request_transcription(url)
-    print("Waiting for completion…")
-    result = poll_transcription(tid)
-    if result.get("error"):
-        print("❌ Error:", result["error"])
-        return
+@lru_cache(maxsize=None)
+def format_clock(seconds):
+    """Format whole seconds as H:MM:SS."""
+    return str(timedelta(seconds=seconds))
 
-    segments = format_segments(result)
-    out      = args.output
+def write_pdf(segments, out):
+    """Render speaker-tagged segments to a wrapped PDF."""
+    c = canvas.Canvas(out, pagesize=letter)
+    width, height = letter
+    margin = 72
+    max_width = width - 2 * margin
+    y = height - margin
+    font_name = "Helvetica"
+    font_size = 10
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(margin, y, "Speaker-Tagged Transcript")
+    y -= 24
+    # One text object per page instead of a BT/ET block per line
+    def begin_text(y):
+        tobj = c.beginText(margin, y)
+        tobj.setFont(font_name, font_size)
+        tobj.setLeading(font_size + 2)
+        return tobj
+    entries = [
+        f"{seg['speaker']} [{format_clock(int(seg['start']))} → "
+        f"{format_clock(int(seg['end']))}]: {seg['text']}"
+        for seg in segments
+    ]
+    tobj = begin_text(y)
+    for entry in entries:
+        for line in wrap_text(entry, font_name, font_size, max_width):
+            if tobj.getY() < margin:
+                c.drawText(tobj)
+                c.showPage()
+                tobj = begin_text(height - margin)
+            tobj.textLine(line)
+    c.drawText(tobj)
+    c.save()
+    print(f"✅ PDF saved to {out}")
 
+def write_output(segments, out):
+    """Write segments to a .pdf/.txt file, or print them if out is None."""
     # PDF output with wrapping
     if out and out.lower().endswith(".pdf"):
-        c = canvas.Canvas(out, pagesize=letter)
-        width, height = letter
-        margin = 72
-        max_width = width - 2 * margin
-        y = height - margin
-        font_name = "Helvetica"
-        font_size = 10
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(margin, y, "Speaker-Tagged Transcript")
-        y -= 24
-        c.setFont(font_name, font_size)
-        for seg in segments:
-            st = str(timedelta(seconds=int(seg["start"])))
-            et = str(timedelta(seconds=int(seg["end"])))
-            header = f"{seg['speaker']} [{st} → {et}]:"
-            wrapped = wrap_text(header + " " + seg["text"],
-                                font_name, font_size, max_width)
-            for line in wrapped:
-                if y < margin:
-                    c.showPage()
-                    y = height - margin
-                    c.setFont(font_name, font_size)
-                c.drawString(margin, y, line)
-                y -= font_size + 2
-        c.save()
-        print(f"✅ PDF saved to {out}")
+        write_pdf(segments, out)
+        return
+    lines = [f"{seg['speaker']} [{seg['start']:.1f}s→{seg['end']:.1f}s]: {seg['text']}"
+             for seg in segments]
+    text = "\n".join(lines)
+    if out:
+        if not out.lower().endswith(".txt"):
+            out += ".txt"
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"✅ Text saved to {out}")
     else:
-        lines = [f"{seg['speaker']} [{seg['start']:.1f}s→{seg['end']:.1f}s]: {seg['text']}"
-                 for seg in segments]
-        text = "\n".join(lines)
-        if out:
-            if not out.lower().endswith(".txt"):
-                out += ".txt"
-            with open(out, "w", encoding="utf-8") as f:
-                f.write(text)
-            print(f"✅ Text saved to {out}")
+        print(text)
+
+@dataclass
+class BatchJob:
+    """Per-file state for batch mode."""
+    path:     str
+    output:   str
+    segments: list = None
+    error:    str  = None
+
+def process_one(job, webhook=None, use_cache=True, gzip_upload=False):
+    """Run upload→request→poll→format_segments for one batch job."""
+    name = os.path.basename(job.path)
+    try:
+        result = transcribe(job.path, prefix=f"[{name}] ", webhook=webhook,
+                            use_cache=use_cache, gzip_upload=gzip_upload)
+        if result.get("error"):
+            job.error = result["error"]
         else:
-            print(text)
+            job.segments = format_segments(result)
+    except Exception as e:
+        job.error = str(e) or type(e).__name__
+    return job
+
+def run_batch(paths, output_dir, fmt, concurrency, webhook=None,
+              use_cache=True, gzip_upload=False):
+    """Transcribe many files concurrently, writing one output per file.
+
+    PDFs are rendered in worker processes so CPU-bound layout overlaps
+    with the remaining uploads and polls.
+    """
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    # One pooled connection per concurrent job keeps every worker kept-alive
+    set_pool_size(concurrency)
+    jobs = []
+    taken = set()
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        out_dir = output_dir or os.path.dirname(path)
+        # Inputs sharing a stem (a/talk.wav, b/talk.wav, talk.mp3) would
+        # overwrite each other; number the later ones instead.
+        out = os.path.join(out_dir, f"{stem}.{fmt}")
+        n = 2
+        while os.path.normcase(os.path.abspath(out)) in taken:
+            out = os.path.join(out_dir, f"{stem}-{n}.{fmt}")
+            n += 1
+        taken.add(os.path.normcase(os.path.abspath(out)))
+        jobs.append(BatchJob(path, out))
+    failed = 0
+    renders = []
+    with ExitStack() as stack:
+        pool = stack.enter_context(ThreadPoolExecutor(max_workers=concurrency))
+        renderer = None
+        if fmt == "pdf":
+            # spawn, not fork: forking while upload/poll threads hold locks
+            # (e.g. stdout's) can deadlock the child
+            renderer = stack.enter_context(ProcessPoolExecutor(
+                max_workers=2, mp_context=multiprocessing.get_context("spawn")
+            ))
+        futures = [pool.submit(process_one, job, webhook, use_cache, gzip_upload)
+                   for job in jobs]
+        for fut in as_completed(futures):
+            job = fut.result()
+            if job.error:
+                failed += 1
+                print(f"❌ {job.path}: {job.error}")
+            elif renderer is not None:
+                renders.append(
+                    (job, renderer.submit(write_pdf, job.segments, job.output))
+                )
+            else:
+                try:
+                    write_output(job.segments, job.output)
+                except Exception as e:
+                    failed += 1
+                    print(f"❌ {job.path}: {e}")
+        for job, render in renders:
+            try:
+                render.result()
+            except Exception as e:
+                failed += 1
+                print(f"❌ {job.path}: {e}")
+    print(f"Done: {len(jobs) - failed}/{len(jobs)} transcribed.")
+
+PARSER = argparse.ArgumentParser(
+    description="AssemblyAI-powered speaker-diarizing transcriber"
+)
+PARSER.add_argument("-o", "--output",
+    help="Output file (.pdf or .txt); output directory with --batch",
+    required=False
+)
+PARSER.add_argument("--list-devices", action="store_true",
+    help="List all audio I/O devices and exit"
+)
+PARSER.add_argument("--device", type=auto_device, default=None,
+    help="Input device (index or name substring)"
+)
+PARSER.add_argument("--batch", nargs="+", metavar="PATH",
+    help="Transcribe several audio files concurrently"
+)
+PARSER.add_argument("--concurrency", type=positive_int, default=5,
+    help="Maximum simultaneous jobs in batch mode (default: 5)"
+)
+PARSER.add_argument("--format", choices=("txt", "pdf"), default="txt",
+    help="Output format for batch mode (default: txt)"
+)
+PARSER.add_argument("--webhook-url", default=None,
+    help="Public URL AssemblyAI should POST completion to (skips polling)"
+)
+PARSER.add_argument("--webhook-port", type=int, default=8765,
+    help="Local port the webhook URL forwards to (default: 8765)"
+)
+PARSER.add_argument("--no-cache", action="store_true",
+    help="Always re-upload and re-transcribe, ignoring $AAI_CACHE"
+)
+PARSER.add_argument("--gzip-upload", action="store_true",
+    help="Gzip WAV/AIFF uploads (falls back to raw if rejected)"
+)
+
+def main():
+    args = PARSER.parse_args()
+
+    if args.list_devices:
+        print(sd.query_devices())
+        return
+
+    webhook = None
+    if args.webhook_url:
+        webhook = WebhookListener(args.webhook_url, args.webhook_port)
+
+    try:
+        if args.batch:
+            run_batch(args.batch, args.output, args.format, args.concurrency,
+                      webhook, not args.no_cache, args.gzip_upload)
+            return
+
+        choice = input("Select input [(1) file, (2) microphone/interface]: ").strip()
+        if choice == "1":
+            audio_path = input("Path to audio file: ").strip()
+        elif choice == "2":
+            info = sd.query_devices(args.device, kind="input")
+            samplerate = int(info["default_samplerate"])
+            channels   = info["max_input_channels"]
+            name       = info["name"]
+            print(f"Recording from {name!r} (index={args.device})")
+            print(f"  samplerate={samplerate} Hz, channels={channels}")
+            print("  Press Enter to stop.")
+            tmp = tempfile.NamedTemporaryFile(suffix=".flac", delete=False)
+            tmp.close()
+            record_to_file(tmp.name, samplerate, channels, args.device)
+            audio_path = tmp.name
+        else:
+            print("Invalid choice.")
+            return
+
+        result = transcribe(audio_path, webhook=webhook,
+                            use_cache=not args.no_cache,
+                            gzip_upload=args.gzip_upload)
+        if result.get("error"):
+            print("❌ Error:", result["error"])
+            return
+
+        write_output(format_segments(result), args.output)
+    finally:
+        if webhook:
+            webhook.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()